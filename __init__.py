@@ -10,41 +10,39 @@ bl_info = {
 
 
 
-if "bpy" in locals():
+#only the UI module is imported on registration, it pulls in parser/export/numpy on first import or export.
+#parser, utils and export don't import bpy and can be used outside of Blender (cli.py, benchmarks)
+if "nozzleboss" in locals():
     import importlib
-    importlib.reload(utils) 
-    importlib.reload(parser) 
-    importlib.reload(nozzleboss) 
-
-
-else:
-    from . import utils
-    from . import parser
-    from . import nozzleboss
-    
-import bpy
-from bpy.props import PointerProperty
-    
-    
-    
-    
+    import sys
+    for name in ("utils", "parser", "export", "blender", "nozzleboss"):
+        if __name__+"."+name in sys.modules:
+            importlib.reload(sys.modules[__name__+"."+name])
 
 
 def register():
+    import bpy
+    from . import nozzleboss
     bpy.utils.register_class(nozzleboss.NOZZLEBOSS_PT_Panel)
     bpy.utils.register_class(nozzleboss.gcode_settings)
     bpy.utils.register_class(nozzleboss.WM_OT_gcode_import)
     bpy.utils.register_class(nozzleboss.WM_OT_gcode_export)
+    bpy.utils.register_class(nozzleboss.WM_OT_gcode_select_layers)
+    bpy.utils.register_class(nozzleboss.WM_OT_gcode_refine_layers)
     bpy.types.Scene.nozzleboss = bpy.props.PointerProperty(type= nozzleboss.gcode_settings)
  
 
 
 
 def unregister():
+    import bpy
+    from . import nozzleboss
     bpy.utils.unregister_class(nozzleboss.NOZZLEBOSS_PT_Panel)
     bpy.utils.unregister_class(nozzleboss.gcode_settings)
     bpy.utils.unregister_class(nozzleboss.WM_OT_gcode_import)
     bpy.utils.unregister_class(nozzleboss.WM_OT_gcode_export)
+    bpy.utils.unregister_class(nozzleboss.WM_OT_gcode_select_layers)
+    bpy.utils.unregister_class(nozzleboss.WM_OT_gcode_refine_layers)
     del bpy.types.Scene.nozzleboss
 
 
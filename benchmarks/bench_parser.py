@@ -0,0 +1,99 @@
+"""
+Parser micro-benchmark, lines/second of GcodeParser.parseFile before and after the fast line path, and of the bulk mode.
+
+Runs with plain Python, the parser does not need bpy:
+    python benchmarks/bench_parser.py [file.gcode] [--repeat N]
+    blender --background --python benchmarks/bench_parser.py -- [file.gcode] [--repeat N]
+Without a file a slicer-like test file is generated in the temp folder.
+"""
+import importlib.util
+import math
+import os
+import sys
+import tempfile
+import time
+
+
+def load_addon():
+    #import the add-on folder as package 'nozzleboss', whatever the folder is called
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location("nozzleboss", os.path.join(root, "__init__.py"), submodule_search_locations=[root])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["nozzleboss"] = module
+    spec.loader.exec_module(module)
+    importlib.import_module("nozzleboss.parser")
+    return module
+
+
+def write_test_file(path, layers=300, points=2000):
+    #perimeters with comments, retractions, travel moves and a G92 per layer, like a sliced cylinder
+    with open(path, 'w') as f:
+        f.write(';FLAVOR:Marlin\nM104 S200\nM140 S60\nG28 ;Home\nG90\nM83\nG92 E0\n')
+        for layer in range(layers):
+            z = 0.3 + layer*0.2
+            f.write(';LAYER:%d\nG92 E0\nG1 F2100 E-0.8\nG0 F9000 X%.3f Y50 Z%.3f\nG1 F2100 E0.8\n;TYPE:WALL-OUTER\nG1 F1800\n' % (layer, 70, z))
+            for i in range(1, points+1):
+                a = 2*math.pi*i/points
+                f.write('G1 X%.3f Y%.3f E%.5f\n' % (50+20*math.cos(a), 50+20*math.sin(a), 0.0021))
+        f.write('M104 S0\nM84\n')
+
+
+def run(parser_class, path, repeat, bulk=False):
+    best = None
+    for _ in range(repeat):
+        then = time.perf_counter()
+        parser_class().parseFile(path, bulk=bulk)
+        took = time.perf_counter()-then
+        best = took if best is None else min(best, took)
+    return best
+
+
+def main(argv):
+    addon = load_addon()
+    GcodeParser = addon.parser.GcodeParser
+
+    class LegacyParser(GcodeParser):
+        #line handling before the dispatch table/fast path: split, strip, hasattr per line and an args dict per move
+        def parseLine(self):
+            bits = self.line.split(';',1)
+            if (len(bits) > 1):
+                GcodeParser.comment = bits[1]
+            command = bits[0].strip()
+            comm = command.split(None, 1)
+            code = comm[0] if (len(comm)>0) else None
+            args = comm[1] if (len(comm)>1) else None
+            if code:
+                if hasattr(self, "parse_"+code):
+                    getattr(self, "parse_"+code)(args)
+                elif code[0] == "T":
+                    self.model.toolnumber = int(code[1:])
+
+        def parse_G1(self, args, type="G1"):
+            self.model.do_G1(self.parseArgs(args), type)
+
+        def parse_G0(self, args, type="G0"):
+            self.model.do_G1(self.parseArgs(args), type)
+
+    repeat = 3
+    if "--repeat" in argv:
+        repeat = int(argv[argv.index("--repeat")+1])
+        del argv[argv.index("--repeat"):argv.index("--repeat")+2]
+    if argv:
+        path = argv[0]
+    else:
+        path = os.path.join(tempfile.gettempdir(), "nozzleboss_bench.gcode")
+        if not os.path.exists(path):
+            write_test_file(path)
+
+    with open(path, 'rb') as f:
+        lines = sum(1 for _ in f)
+    print("%s: %d lines, %.1f MB" % (path, lines, os.path.getsize(path)/1e6))
+    for name, parser_class, bulk in (("legacy parseLine", LegacyParser, False), ("parseLine", GcodeParser, False), ("bulk (mmap)", GcodeParser, True)):
+        took = run(parser_class, path, repeat, bulk)
+        print("%-20s %8.3f s  %12.0f lines/s" % (name, took, lines/took))
+
+
+if __name__ == "__main__":
+    #blender passes its own arguments, script arguments come after '--'
+    argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else sys.argv[1:]
+    main(argv)
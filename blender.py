@@ -0,0 +1,242 @@
+"""
+Blender side of nozzleboss: reading mesh data and textblocks, building objects from parsed G-code and
+writing the beveled path mesh. The other modules import without bpy, this one is only imported when Blender is there.
+"""
+import bpy
+import numpy as np
+
+from .parser import segments_to_meshdata
+from .utils import DEFAULT_TEXTBLOCKS, bevel_arrays, used_verts
+
+
+def read_verts(mesh):
+    mverts_co = np.zeros((len(mesh.vertices) * 3), dtype=float)
+    mesh.vertices.foreach_get("co", mverts_co)
+    return np.reshape(mverts_co, (len(mesh.vertices), 3))
+
+
+def read_edges(mesh): #return np.array
+    fastedges = np.zeros((len(mesh.edges)*2), dtype=int) # [0.0, 0.0] * len(mesh.edges)
+    mesh.edges.foreach_get("vertices", fastedges)
+    return np.reshape(fastedges, (len(mesh.edges), 2))
+
+
+def ensure_textblocks():
+    #auto create missing textblocks, needed if you model from scratch
+    for name, text in DEFAULT_TEXTBLOCKS.items():
+        if not bpy.data.texts.get(name):
+            bpy.data.texts.new(name)
+            bpy.data.texts[name].write(text)
+
+
+def read_textblock(name):
+    txt = bpy.data.texts[name]
+    textblock=[]
+    for l in txt.lines:
+        textblock.append(l.body+'\n')   
+            
+    textblock="".join(textblock) 
+    return textblock
+
+
+#loop vert indices and the float colors of every loop of each vertex color map, with foreach_get
+def read_vcol_colors(obj, vcol_names=('Flow', 'Speed', 'Tool')):
+    mesh = obj.data
+    loop_verts = np.zeros(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    colors = []
+    for vcol_name in vcol_names:
+        color = np.zeros(len(mesh.loops)*4, dtype=np.float32)
+        mesh.vertex_colors[vcol_name].data.foreach_get("color", color)
+        colors.append(color.reshape(-1, 4))
+    return loop_verts, colors
+
+
+#one luma value per vert of each map, all verts at once. a vert takes the color of its last loop
+#(like the old {v_idx: l_idx} map), verts in no face read as white
+def vcol_weights(n_verts, loop_verts, colors):
+    last_loop = np.full(n_verts, -1, dtype=np.int64)
+    np.maximum.at(last_loop, loop_verts, np.arange(len(loop_verts)))
+    has_loop = last_loop >= 0
+    weights = []
+    for color in colors:
+        col = np.ones((n_verts, 3))
+        col[has_loop] = color[last_loop[has_loop], :3]
+        weights.append(col[:, 0]*0.299+col[:, 1]*0.587+col[:, 2]*0.114)#/3 already normalized
+    return weights
+
+
+def read_weightmaps_from_vcol(obj, vcol_names=('Flow', 'Speed', 'Tool')):
+    loop_verts, colors = read_vcol_colors(obj, vcol_names)
+    return vcol_weights(len(obj.data.vertices), loop_verts, colors)
+
+
+def read_weightmap_from_vcol(obj, vcol_name):
+    return read_weightmaps_from_vcol(obj, (vcol_name,))[0]
+
+
+def obj_from_pydata(name, verts, edges=None, close=True, collection_name=None, faces=None):
+    #verts/edges/faces can be lists or arrays, the mesh is filled with foreach_set (write_mesh)
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    if edges is None:
+        # join vertices into one uninterrupted chain of edges.
+        k = np.arange(len(verts)-1)
+        edges = np.column_stack((k, k+1))
+        if close and len(verts) > 1:
+            edges = np.append(edges, [[len(verts)-1, 0]], axis=0) #connect last to first
+            
+    me = bpy.data.meshes.new(name)
+    write_mesh(me, verts, edges, faces)
+      
+    obj = bpy.data.objects.new(name, me)
+   
+   
+    #Move into collection if specified
+    if collection_name != None: #make argument optional
+        
+        #collection exists                   
+        collection = bpy.data.collections.get(collection_name)
+        if collection: 
+            bpy.data.collections[collection_name].objects.link(obj)   
+            
+        
+        else:
+            collection = bpy.data.collections.new(collection_name)
+            bpy.context.scene.collection.children.link(collection) #link collection to main scene
+            bpy.data.collections[collection_name].objects.link(obj) 
+    
+    return obj
+
+
+def write_mesh(mesh, verts, edges, faces=None):
+    #replace the geometry of mesh with (n, 3) verts, (m, 2) edges and (k, sides) faces, foreach_set in one go
+    mesh.clear_geometry()
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set("vertices", edges.ravel())
+    if faces is not None and len(faces):
+        faces = np.asarray(faces, dtype=np.int32)
+        sides = faces.shape[1]
+        mesh.loops.add(faces.size)
+        mesh.loops.foreach_set("vertex_index", faces.ravel())
+        mesh.polygons.add(len(faces))
+        mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, sides, dtype=np.int32))
+        if not mesh.polygons.bl_rna.properties["loop_total"].is_readonly: #read only since Blender 4.0
+            mesh.polygons.foreach_set("loop_total", np.full(len(faces), sides, dtype=np.int32))
+    #edges of the faces are all there, calc_edges only links the loops to them
+    mesh.update(calc_edges=True)
+
+
+def bevel_path(obj):#ver_idx wise only extrude, but in respect to layerheight and with vasemode detection
+                    #and clean-up loose verts before extruding
+    #height verts, edges and quads are computed from the vert/edge arrays (utils.bevel_arrays) and written
+    #back in one go, no operators, edit mode or bmesh
+    verts, edges, faces = bevel_arrays(read_verts(obj.data), read_edges(obj.data))
+    write_mesh(obj.data, verts, edges, faces)
+
+
+def write_attribute(mesh, name, domain, values):
+    #integer attribute of mesh, one value per vert ('POINT') or face ('FACE')
+    attribute = mesh.attributes.get(name)
+    if attribute is None:
+        attribute = mesh.attributes.new(name, 'INT', domain)
+    attribute.data.foreach_set("value", np.asarray(values, dtype=np.int32))
+
+
+def read_attribute(mesh, name, size):
+    values = np.zeros(size, dtype=np.int32)
+    mesh.attributes[name].data.foreach_get("value", values)
+    return values
+
+
+def select_layers(obj, first, last, hide=False):
+    #select the verts, edges and faces of layers first..last by the layer attributes of a layer attribute import,
+    #with hide the rest is hidden (edit mode). Works on the mesh data, so the object has to be in object mode
+    mesh = obj.data
+    inside = read_attribute(mesh, "layer", len(mesh.vertices))
+    inside = (inside >= first) & (inside <= last)
+    edges = read_edges(mesh)
+    edges_inside = inside[edges[:, 0]] & inside[edges[:, 1]] if len(edges) else np.zeros(0, dtype=bool)
+    faces_inside = read_attribute(mesh, "face_layer", len(mesh.polygons))
+    faces_inside = (faces_inside >= first) & (faces_inside <= last)
+    for items, selected in ((mesh.vertices, inside), (mesh.edges, edges_inside), (mesh.polygons, faces_inside)):
+        items.foreach_set("select", selected)
+        items.foreach_set("hide", ~selected if hide else np.zeros(len(selected), dtype=bool))
+    mesh.update()
+    return int(np.count_nonzero(inside))
+
+
+def path_meshdata(model):
+    #verts, edges and faces of the beveled path of a classified GcodeModel, computed before the mesh is written
+    #once, with the segment row every vert comes from (height verts after the path verts, like bevel_arrays)
+    verts, edges, source = segments_to_meshdata(model.segments, sources=True)
+    source = source[used_verts(len(verts), edges)]
+    verts, edges, faces = bevel_arrays(verts, edges)
+    return verts, edges, faces, np.concatenate((source, source))
+
+
+def write_layer_attributes(mesh, model, source, faces):
+    #height verts take the values of their path vert, a face those of the segment it extrudes to.
+    #style is the parser's segment style, TRAVEL (0) or EXTRUDE (1), not a slicer feature type (;TYPE: comments
+    #aren't parsed): 0 on the verts a travel move ends at, 1 on extrusions and on every face
+    segs = model.segments
+    for name, column in (("layer", segs.layerIdx), ("tool", segs.toolnumber), ("style", segs.style)):
+        values = column[source]
+        write_attribute(mesh, name, 'POINT', values)
+        write_attribute(mesh, "face_"+name, 'FACE', values[faces[:, 1]])
+
+
+def ensure_vcols(mesh):
+    for name in ('Speed', 'Flow', 'Tool'):
+        if mesh.vertex_colors.get(name) is None:
+            mesh.vertex_colors.new(name=name)
+
+
+def refine_path(obj, model, layer_attributes=False):
+    #replace the path mesh of obj by the one of model, e.g. a level of detail preview by a model with some
+    #layers at full resolution. Geometry is new, so painted vertex colors start over
+    verts, edges, faces, source = path_meshdata(model)
+    write_mesh(obj.data, verts, edges, faces)
+    if layer_attributes:
+        write_layer_attributes(obj.data, model, source, faces)
+    ensure_vcols(obj.data)
+    return len(verts)
+
+
+def draw_model(model, split_layers=False, layer_attributes=False):
+    #create blender objects of a classified GcodeModel: one object per layer, or the beveled path object
+    #with its vertex color maps and textblocks. layer_attributes: the path object gets the layer, tool and
+    #style (travel/extrude) of the segments as int attributes instead, per vert and per face (face_layer...)
+    if split_layers:
+        #objects are numbered like in a whole file import, also when only a range of layers was parsed
+        i=model.range["first_layer"] if model.range else 0
+        for layer in model.layers:
+            verts, edges = segments_to_meshdata(layer)
+            if len(verts)>0:
+                obj_from_pydata(str(i), verts, edges, close=False, collection_name="Layers")
+                i+=1
+
+    else:
+        #path extruded down by the layer height like bevel_path does
+        verts, edges, faces, source = path_meshdata(model)
+        obj = obj_from_pydata("Gcode", verts, edges, close=False, collection_name="Layers", faces=faces)
+
+        if layer_attributes:
+            write_layer_attributes(obj.data, model, source, faces)
+
+        #set active
+        bpy.context.view_layer.objects.active = bpy.data.objects[obj.name]
+
+        #create vcol maps and textblocks
+        ensure_vcols(obj.data)
+
+        ensure_textblocks()
+        return obj
+
+
+
+
+
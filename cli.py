@@ -0,0 +1,312 @@
+"""
+Headless batch processing of G-code and .blend files, without the Blender UI. Settings are given on the command
+line (same names as in the nozzleboss panel), the files are processed in parallel, one process per file, and every
+file is reported with its timing and throughput.
+
+    python cli.py convert a.gcode b.gcode -o out/ --jobs 8 --min-flow 0.6 --build-volume-x 220 --build-volume-y 220
+    python cli.py export part.blend other.blend -o out/ --max-speed 0.8 --blender /path/to/blender
+    blender --background --python cli.py -- convert a.gcode -o out/
+
+import   parse and classify only, to check files and measure import throughput
+convert  G-code to nozzleboss G-code: import, bevel and export like the add-on does with the given settings.
+         There are no painted maps, flow/speed weights are constant (--flow-weight/--speed-weight, 1 = white)
+export   re-export .blend files with their painted Flow/Speed/Tool maps and the given settings,
+         every file in its own background Blender
+"""
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+#option, type, default, help; attribute names are the ones of the nozzleboss scene settings
+EXPORT_SETTINGS = (
+    ("nozzle_diameter", float, 0.4, "mm"),
+    ("extrusion_speed", int, 30, "mm/s"),
+    ("travel_speed", int, 60, "mm/s"),
+    ("build_volume_x", int, 0, "mm, exported G-code is centered on the build plate"),
+    ("build_volume_y", int, 0, "mm"),
+    ("min_flow", float, 0.4, "flow multiplier of black in the Flow map"),
+    ("max_flow", float, 1., "flow multiplier of white in the Flow map"),
+    ("min_speed", float, 0.2, "speed multiplier of black in the Speed map"),
+    ("max_speed", float, 1., "speed multiplier of white in the Speed map"),
+    ("area_extrude", bool, False, "extrusion from segment area"),
+    ("z_height_extrude", bool, False, "extrusion from segment height"),
+    ("tiebreak_xy", bool, False, "islands at the same height in order of X, Y of their start instead of vert order"),
+)
+IMPORT_SETTINGS = (
+    ("subdivide", bool, False, "subdivide long segments"),
+    ("max_segment_size", float, 1, "mm, with --subdivide"),
+    ("low_memory", bool, False, "float32 segment table"),
+    ("bulk_parse", bool, False, "mmap + numpy parser"),
+    ("parse_workers", int, 1, "processes of the bulk parser per file"),
+    ("parse_cache", bool, False, "keep parsed files in the on-disk parse cache, a repeated import skips parsing"),
+    ("parse_cache_dir", str, "", "parse cache folder, empty: nozzleboss_cache in the temporary folder"),
+    ("parse_cache_size", int, 1024, "MB, least recently used files are deleted above it"),
+)
+
+#printed by the Blender processes of the export command, the line after it is the json result
+RESULT_TAG = "nozzleboss-cli-result"
+
+
+def load_addon():
+    #import the add-on folder as package 'nozzleboss', whatever the folder is called, with its bpy-free modules
+    if __package__:
+        module = sys.modules[__package__]
+    elif "nozzleboss" in sys.modules and getattr(sys.modules["nozzleboss"], "__path__", None) == [os.path.dirname(os.path.abspath(__file__))]:
+        module = sys.modules["nozzleboss"]
+    else:
+        root = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.util.spec_from_file_location("nozzleboss", os.path.join(root, "__init__.py"), submodule_search_locations=[root])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["nozzleboss"] = module
+        spec.loader.exec_module(module)
+    for name in ("utils", "parser", "export"):
+        importlib.import_module(module.__name__+"."+name)
+    return module
+
+
+def luma(gray):
+    #weight of a vertex color with this gray value, the way read_weightmaps_from_vcol computes it
+    return gray*0.299+gray*0.587+gray*0.114
+
+
+def read_textblocks(settings):
+    #Start/End/T0/T1 G-code from the given files, the add-on defaults otherwise
+    utils = load_addon().utils
+    textblocks = {}
+    for name, path in (("Start", settings.start), ("End", settings.end), ("T0", settings.t0), ("T1", settings.t1)):
+        if path:
+            with open(path) as f:
+                text = f.read()
+        else:
+            text = utils.DEFAULT_TEXTBLOCKS[name]
+        textblocks[name] = utils.textblock_text(text)
+    return textblocks
+
+
+def import_file(path, settings):
+    #parse, subdivide and classify like import_gcode()
+    parser = load_addon().parser
+    cache = parser.ParseCache(settings.parse_cache_dir or None, settings.parse_cache_size<<20) if settings.parse_cache else None
+    return parser.import_model(path, np.float32 if settings.low_memory else np.float64, settings.max_segment_size if settings.subdivide else None,
+                               settings.bulk_parse, settings.parse_workers if settings.bulk_parse else 1, cache)
+
+
+def run_import(path, out_path, settings):
+    model = import_file(path, settings)
+    return {"segments": len(model.segments), "layers": len(model.layers)}
+
+
+def run_convert(path, out_path, settings):
+    addon = load_addon()
+    model = import_file(path, settings)
+    verts, edges = addon.parser.segments_to_meshdata(model.segments)
+    verts, edges, faces = addon.utils.bevel_arrays(verts, edges)
+    flow = np.full(len(verts), luma(settings.flow_weight))
+    speed = np.full(len(verts), luma(settings.speed_weight))
+    tool = np.full(len(verts), luma(1.))
+    written = addon.export.write_gcode(out_path, verts, edges, flow, speed, tool, settings, read_textblocks(settings))
+    return {"segments": len(model.segments), "layers": len(model.layers), "exported": written}
+
+
+def run_export_loaded(settings):
+    #inside the Blender of an export job: export an object of the loaded .blend with the given settings
+    import bpy
+    addon = load_addon()
+    blender = importlib.import_module(addon.__name__+".blender")
+    if settings.object:
+        obj = bpy.data.objects[settings.object]
+    else:
+        #the object the importer created, or the only mesh
+        meshes = [o for o in bpy.data.objects if o.type == 'MESH']
+        flagged = [o for o in meshes if o.data.vertex_colors.get('Flow')]
+        if len(flagged) != 1 and len(meshes) != 1:
+            raise ValueError("%s: %d mesh objects, choose one with --object" % (bpy.data.filepath, len(meshes)))
+        obj = flagged[0] if len(flagged) == 1 else meshes[0]
+    verts = blender.read_verts(obj.data)
+    edges = blender.read_edges(obj.data)
+    names = [name for name in ('Flow', 'Speed', 'Tool') if obj.data.vertex_colors.get(name)]
+    weights = dict(zip(names, blender.read_weightmaps_from_vcol(obj, names)))
+    for name in ('Flow', 'Speed', 'Tool'):
+        if name not in weights:
+            weights[name] = np.full(len(verts), luma(1.))
+    textblocks = read_textblocks(settings)
+    for name in textblocks:
+        if bpy.data.texts.get(name) and not getattr(settings, name.lower()):
+            textblocks[name] = blender.read_textblock(name)
+    written = addon.export.write_gcode(settings.output, verts, edges, weights['Flow'], weights['Speed'], weights['Tool'], settings, textblocks)
+    print(RESULT_TAG)
+    print(json.dumps({"object": obj.name, "exported": written}))
+
+
+def run_export(path, out_path, settings):
+    #one background Blender per .blend, this process only waits for it
+    args = [settings.blender, "--background", "--factory-startup", path, "--python", os.path.abspath(__file__), "--",
+            "export-loaded", "--output", out_path]
+    if settings.object:
+        args += ["--object", settings.object]
+    for name in ("start", "end", "t0", "t1"):
+        if getattr(settings, name):
+            args += ["--"+name, os.path.abspath(getattr(settings, name))]
+    args += setting_args(settings)
+    done = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    lines = done.stdout.splitlines()
+    if RESULT_TAG not in lines:
+        raise RuntimeError("blender exited with %d:\n%s" % (done.returncode, "\n".join(lines[-20:])))
+    return json.loads(lines[lines.index(RESULT_TAG)+1])
+
+
+COMMANDS = {"import": run_import, "convert": run_convert, "export": run_export}
+
+
+def setting_args(settings):
+    #command line of the settings, for the Blender processes of export
+    args = []
+    for name, kind, default, help in EXPORT_SETTINGS:
+        value = getattr(settings, name)
+        if kind is bool:
+            args += ["--"+name.replace("_", "-")] if value else []
+        else:
+            args += ["--"+name.replace("_", "-"), str(value)]
+    return args
+
+
+def output_path(path, settings):
+    if settings.command == "import":
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    #convert never writes next to its input with the same name
+    name += ".gcode" if settings.command == "export" else ".nozzleboss.gcode"
+    if not settings.output:
+        return os.path.join(os.path.dirname(os.path.abspath(path)), name)
+    if os.path.isdir(settings.output) or len(settings.files) > 1 or settings.output.endswith(('/', '\\')):
+        return os.path.join(settings.output, name)
+    return settings.output
+
+
+def process_file(path, out_path, settings):
+    #worker: one file, timing and sizes for the report, errors are reported instead of raised
+    then = time.perf_counter()
+    result = {"file": path, "output": out_path, "size": 0}
+    try:
+        result["size"] = os.path.getsize(path)
+        result.update(COMMANDS[settings.command](path, out_path, settings))
+    except Exception as error:
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+    result["seconds"] = time.perf_counter()-then
+    return result
+
+
+def report(result, k, total):
+    head = "[%*d/%d] %s" % (len(str(total)), k, total, result["file"])
+    if "error" in result:
+        print("%s  FAILED after %.2f s  %s" % (head, result["seconds"], result["error"]), flush=True)
+        return
+    seconds = max(result["seconds"], 1e-9)
+    line = "%s  %.2f s  %.1f MB  %.1f MB/s" % (head, seconds, result["size"]/1e6, result["size"]/1e6/seconds)
+    if "segments" in result:
+        line += "  %d segments  %.0f segments/s  %d layers" % (result["segments"], result["segments"]/seconds, result["layers"])
+    if "exported" in result:
+        line += "  %d exported" % result["exported"]
+    if result["output"]:
+        line += "  -> %s" % result["output"]
+    print(line, flush=True)
+
+
+def run(settings):
+    files = settings.files
+    if settings.command != "import" and settings.output and (len(files) > 1 or settings.output.endswith(('/', '\\'))):
+        os.makedirs(settings.output, exist_ok=True)
+    jobs = max(1, min(settings.jobs, len(files)))
+    then = time.perf_counter()
+    results = []
+    if jobs == 1:
+        for path in files:
+            results.append(process_file(path, output_path(path, settings), settings))
+            report(results[-1], len(results), len(files))
+    else:
+        if settings.command == "export":
+            #the work happens in the Blender processes, threads are enough to wait for them
+            pool = concurrent.futures.ThreadPoolExecutor(jobs)
+        else:
+            #fork keeps the loaded add-on (and bpy inside Blender) in the workers
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            pool = concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context)
+        with pool:
+            futures = [pool.submit(process_file, path, output_path(path, settings), settings) for path in files]
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
+                report(results[-1], len(results), len(files))
+    wall = time.perf_counter()-then
+
+    failed = sum("error" in result for result in results)
+    size = sum(result["size"] for result in results if "error" not in result)
+    busy = sum(result["seconds"] for result in results)
+    print("%d files, %d failed, %.1f MB in %.2f s (%.1f MB/s, %.2f s in workers, %d jobs)"
+          % (len(results), failed, size/1e6, wall, size/1e6/max(wall, 1e-9), busy, jobs), flush=True)
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="nozzleboss", description="Batch import/convert/export of G-code without the Blender UI.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    helps = {
+        "import": "parse and classify G-code files",
+        "convert": "G-code to nozzleboss G-code with the given settings",
+        "export": "export .blend files with their painted maps and the given settings",
+        "export-loaded": "export an object of the .blend this Blender has loaded (used by export)"}
+    for command, help in helps.items():
+        sub = commands.add_parser(command, help=help)
+        if command == "export-loaded":
+            sub.add_argument("--output", required=True, help="G-code file")
+        else:
+            sub.add_argument("files", nargs="+")
+            sub.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="files processed in parallel")
+        if command in ("convert", "export", "export-loaded"):
+            if command != "export-loaded":
+                sub.add_argument("-o", "--output", default="", help="output folder, or file for a single input")
+            for name in ("start", "end", "t0", "t1"):
+                sub.add_argument("--"+name, default="", metavar="FILE", help="%s G-code, instead of the default" % name.capitalize())
+        if command == "convert":
+            sub.add_argument("--flow-weight", type=float, default=1., help="gray value of the Flow map, 0-1")
+            sub.add_argument("--speed-weight", type=float, default=1., help="gray value of the Speed map, 0-1")
+        if command in ("export", "export-loaded"):
+            sub.add_argument("--object", default="", help="object to export, default: the imported G-code object")
+        if command == "export":
+            binary = sys.modules["bpy"].app.binary_path if "bpy" in sys.modules else "blender"
+            sub.add_argument("--blender", default=binary, help="Blender executable, default: %(default)s")
+        options = IMPORT_SETTINGS if command in ("import", "convert") else ()
+        options += EXPORT_SETTINGS if command != "import" else ()
+        for name, kind, default, help in options:
+            option = "--"+name.replace("_", "-")
+            if kind is bool:
+                sub.add_argument(option, dest=name, action="store_true", help=help)
+            else:
+                sub.add_argument(option, dest=name, type=kind, default=default, help="%s, default: %s" % (help, default))
+    return parser
+
+
+def main(argv):
+    settings = build_parser().parse_args(argv)
+    load_addon()
+    if settings.command == "export-loaded":
+        run_export_loaded(settings)
+        return 0
+    return run(settings)
+
+
+if __name__ == "__main__":
+    #blender passes its own arguments, script arguments come after '--'
+    argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else sys.argv[1:]
+    code = main(argv)
+    if code:
+        sys.exit(code)
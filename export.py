@@ -0,0 +1,403 @@
+import collections
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .utils import find_islands, sort_Z, reorder_islands, remap, edges_exist
+
+#E axis is in mm not mm³, 2.405 is 1mm of 1.75mm filament (r*(PI*r), 0.875*PI*0.875
+FILAMENT_AREA = 2.405281875
+
+#columns of segment_indices(): P1, P2, P3, P4, then the verts the flow/tool and speed weights are read from
+FLOW, SPEED = 4, 5
+
+
+def segment_indices(indices, offsets, closed):
+    #vert indices of all extrusion segments of the (sorted) CSR islands, one row per segment: P1, P2, P3, P4, flow vert, speed vert
+    #first half of an island is the nozzle path (e_edges), second half the corresponding height verts (h_edges)
+    #P1-P2 is the path segment, P4-P3 the height edge next to it. flow/tool weight is taken at P2, speed weight at P1,
+    #the closing segment of a closed island takes flow/tool from the first vert of the island
+    half = np.diff(offsets)//2
+    regular = np.maximum(half-1, 0)
+    counts = regular+(np.asarray(closed, dtype=bool) & (half > 1))
+    island = np.repeat(np.arange(len(counts)), counts)
+    j = np.arange(int(counts.sum()))-np.repeat(np.cumsum(counts)-counts, counts)
+    base = offsets[:-1][island]
+    h = half[island]
+    closing = j == regular[island]
+    #positions in indices of e[j], e[j+1], h[j], h[j+1], the closing segment goes from e[n-1] back to e[0]
+    e1 = base+j
+    e2 = np.where(closing, base, e1+1)
+    h1 = base+h+j
+    h2 = np.where(closing, base+h, h1+1)
+    idx = np.column_stack((indices[e1], indices[e2], indices[h2], indices[h1], indices[e2], indices[e1])).astype(np.int64)
+    return idx, counts
+
+
+def row_norms(v):
+    #np.linalg.norm of every row, bit for bit: norm() of a vector is sqrt(dot(v, v)) and dot goes through BLAS
+    #(which may use fma), a stack of (1,3)@(3,1) matmuls uses the same dot per row, sqrt((v*v).sum(1)) would not
+    return np.sqrt(np.matmul(v[:, None, :], v[:, :, None])[:, 0, 0])
+
+
+def extrusion_amounts(P1, P2, P3, P4, width, multiplier, area_extrude=False, z_height_extrude=False):
+    #E of every segment from (n, 3) corner arrays, same math as the per segment export loop
+    if area_extrude is True:
+        area = quad_areas(np.stack((P1, P2, P3, P4), axis=1))
+        E_volume = area*width*multiplier
+    else:
+        if z_height_extrude is True:
+            dist = row_norms((P2+P3)/2-(P1+P4)/2)
+            height = np.abs(P1[:, 2]+P2[:, 2]-P3[:, 2]-P4[:, 2])
+        else:
+            dist = row_norms(P3-P4)
+            height = row_norms(P3-P2)
+        E_volume = dist*height*width*multiplier
+    return E_volume/FILAMENT_AREA
+
+
+def tool_changes(tool_colors):
+    #True where the tool color differs from the segment before (first segment always, the export starts without a tool)
+    prev = np.empty(len(tool_colors), dtype=np.float64)
+    prev[:1] = -1
+    prev[1:] = tool_colors[:-1]
+    return tool_colors != prev
+
+
+def format_coords(values, precision=4):
+    #str(round(v, precision)) of every value of a float array, as a list. round() of a numpy float is np.round
+    #and str() of the result is the shortest repr, same as repr() of the python float
+    return list(map(repr, np.round(np.asarray(values, dtype=np.float64), precision).tolist()))
+
+
+def extrude_lines(coords, next, E, F, prev_F=-1, precision=4):
+    #utils.extrude for all segments at once: (n, 3) start and end points, E and F per segment,
+    #one 'G1 X.. Y.. Z.. E.. F..' string per segment, only changed axes, byte identical to extrude()
+    coords = np.asarray(coords, dtype=np.float64)
+    next = np.asarray(next, dtype=np.float64)
+    changed = (coords != next).tolist()
+    axes = []
+    for a, letter in enumerate("XYZ"):
+        text = format_coords(next[:, a], precision)
+        axes.append([letter+t+' ' if c[a] else '' for t, c in zip(text, changed)])
+    F = np.asarray(F, dtype=np.float64)
+    feed = (F != prev_F).tolist()
+    #int(F*60) truncates, so does astype
+    speeds = [' F'+t+'\n' if c else '' for t, c in zip(map(str, (F*60).astype(np.int64).tolist()), feed)]
+    return ['G1 '+x+y+z+'E'+e+f for x, y, z, e, f in zip(axes[0], axes[1], axes[2], format_coords(E, precision), speeds)]
+
+
+def travel_lines(coords, next, travel_speed, extrusion_speed, precision=4):
+    #utils.travel for (n, 3) start and end points at once, byte identical to travel()
+    coords = np.asarray(coords, dtype=np.float64)
+    next = np.asarray(next, dtype=np.float64)
+    changed = (coords != next).tolist()
+    head = 'G1 F'+str(travel_speed)+'\n'+'G1 '
+    tail = '\nG1 '+'F'+str(extrusion_speed)+'\n'
+    X, Y, Z = (format_coords(next[:, a], precision) for a in range(3))
+    return [head+('X'+x+' ' if c[0] else '')+('Y'+y+' ' if c[1] else '')+('Z'+z if c[2] else '')+tail
+            for x, y, z, c in zip(X, Y, Z, changed)]
+
+
+def quad_areas(quads):
+    #area of (N, 4, 3) quads in one pass, the largest of the four vertex rotations like the old
+    #max(poly_area(q) for every rotation of q). polygon area = |sum of cross(v_i, v_i+1) . unit normal| / 2,
+    #the cross sum is the same for every rotation, only the normal of the first three verts changes
+    quads = np.asarray(quads, dtype=np.float64)
+    nxt = np.roll(quads, -1, axis=1)
+    total = np.cross(quads, nxt).sum(axis=1)
+    normals = np.cross(nxt-quads, np.roll(quads, -2, axis=1)-quads) #normal of verts r, r+1, r+2 for every rotation r
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normals /= np.sqrt((normals*normals).sum(axis=2))[:, :, None]
+        areas = np.abs((normals*total[:, None, :]).sum(axis=2))/2
+    #rotations whose first three verts are collinear (duplicate verts) have no normal, the others still give the area
+    #of the quad. no valid rotation at all: flat quad without area
+    areas[np.isnan(areas)] = -1
+    return np.maximum(areas.max(axis=1), 0)
+
+
+def travel_distances(a, b):
+    #(Vector(a)-Vector(b)).length of mathutils for every row: float32 coordinates and difference, float32 squares
+    #summed in double from z to x
+    d = np.asarray(a, dtype=np.float32)-np.asarray(b, dtype=np.float32)
+    sq = (d*d).astype(np.float64)
+    return np.sqrt(sq[:, 2]+sq[:, 1]+sq[:, 0])
+
+
+def island_blocks(counts, size=65536):
+    #(first, stop) island ranges of about size segments, the export formats and writes one block at a time
+    first = 0
+    n = 0
+    for k, count in enumerate(np.asarray(counts).tolist()):
+        n += count
+        if n >= size:
+            yield first, k+1
+            first = k+1
+            n = 0
+    if first < len(counts):
+        yield first, len(counts)
+
+
+class GcodeWriter:
+    """
+    Buffered, atomic G-code file writer. Text is collected up to buffer_size characters and then written to a
+    temporary file next to the target, close() renames it to the target. A failed export leaves the old file
+    untouched instead of a half written one. As context manager an exception discards the temporary file.
+    """
+    def __init__(self, path, buffer_size=1<<20):
+        self.path = os.path.abspath(path)
+        folder, name = os.path.split(self.path)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=name+'.', suffix='.tmp', dir=folder)
+        self.file = os.fdopen(fd, 'w')
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, lines):
+        self._buffer.extend(lines)
+        self._size += sum(map(len, lines))
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self._buffer))
+        self._buffer = []
+        self._size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        #mkstemp files are private, give the result the permissions of the file it replaces or of a new file
+        if os.path.exists(self.path):
+            mode = os.stat(self.path).st_mode & 0o777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(self.tmp_path, mode)
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+def format_extrusions(path_start, path_end, E, F, tools, tool_changed, textblocks, prev_F=-1):
+    #one G1 line per segment, the tool textblock goes in front of the segment where the tool changes
+    lines = extrude_lines(path_start, path_end, E, F, prev_F)
+    for i in np.flatnonzero(tool_changed).tolist():
+        if tools[i]<0.5:
+            lines[i] = textblocks['T1']+lines[i]
+        else:
+            lines[i] = textblocks['T0']+lines[i]
+    return lines
+
+
+def island_keys(path_start, path_end, E, F, tools, tool_changed, begins, ends, textblocks):
+    #content hash of the extrusion G-code of every island: one record per segment of everything
+    #format_extrusions() reads, plus the tool textblocks
+    records = np.column_stack((path_start, path_end, E, F, tools, tool_changed))
+    row = records.shape[1]*records.itemsize
+    data = memoryview(records).cast('B')
+    base = hashlib.blake2b(digest_size=16)
+    base.update((textblocks['T0']+'\0'+textblocks['T1']).encode())
+    keys = []
+    for lo, hi in zip(begins, ends):
+        digest = base.copy()
+        digest.update(data[lo*row:hi*row])
+        keys.append(digest.digest())
+    return keys
+
+
+class IslandArrays:
+    """
+    Everything the export derives from the mesh alone: CSR islands sorted by Z, closed island flags, the segment
+    vert indices of segment_indices() and the first path vert and first height vert of every island.
+    Export settings don't change any of it, ExportCache keeps it between exports of the same mesh.
+    """
+    def __init__(self, verts, edges, tiebreak_xy=False):
+        verts = np.asarray(verts, dtype=np.float64)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        indices, offsets = find_islands(edges)
+        self.indices, self.offsets = reorder_islands(indices, offsets, sort_Z(indices, offsets, verts, tiebreak_xy))
+        half = np.diff(self.offsets)//2
+
+        #all extrusion segments of the object at once: P1-P4 vert index arrays, E and F as array math
+        #e_edges (first half of island) is the real nozzle path, h_edges (second half) the corresponding height verts
+        self.first = self.indices[self.offsets[:-1]]
+        self.middle = self.indices[self.offsets[:-1]+half]
+        last_path = self.indices[np.where(half > 0, self.offsets[:-1]+half-1, self.offsets[1:]-1)]
+        self.closed = edges_exist(edges, last_path, self.first)
+        self.idx, self.counts = segment_indices(self.indices, self.offsets, self.closed)
+
+
+def array_fingerprint(*arrays):
+    #hash of the contents, dtypes and shapes of the arrays
+    digest = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        digest.update(("%s%s" % (a.dtype.str, a.shape)).encode())
+        digest.update(a.view(np.uint8).ravel() if a.size else b'')
+    return digest.hexdigest()
+
+
+class ExportCache:
+    """
+    Derived export arrays (IslandArrays, weightmaps) of the last exported objects, so exporting an object again
+    with other settings only redoes the arithmetic and formatting. Every value is stored with a fingerprint of
+    the arrays it was derived from and recomputed when they changed, e.g. after editing the mesh or painting.
+    More than size objects evict the one exported longest ago.
+    """
+    def __init__(self, size=4):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, kind, arrays, compute):
+        #compute() for object key, or the cached result as long as arrays have the same fingerprint
+        fingerprint = array_fingerprint(*arrays)
+        entry = self.entries.pop(key, {})
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        if kind not in entry or entry[kind][0] != fingerprint:
+            entry[kind] = (fingerprint, compute())
+        return entry[kind][1]
+
+    def island_gcode(self, key):
+        #island_cache of write_gcode() for object key
+        return self.get(key, "gcode", (), dict)
+
+    def islands(self, key, verts, edges, tiebreak_xy=False):
+        kind = "islands xy" if tiebreak_xy else "islands"
+        return self.get(key, kind, (verts, edges), lambda: IslandArrays(verts, edges, tiebreak_xy))
+
+    def clear(self):
+        self.entries.clear()
+
+
+#cache of the add-on export operator
+export_cache = ExportCache()
+
+
+def write_gcode(filepath, verts, edges, extrusion_weights, speed_weights, tool_colors, settings, textblocks, islands=None, island_cache=None):
+    """
+    Export engine, G-code of a beveled extrusion path mesh without Blender: verts/edges arrays of the mesh, one
+    flow, speed and tool weight (luma of the vertex colors) per vert. settings is anything with the attributes of
+    the nozzleboss scene settings, textblocks maps 'Start', 'End', 'T0' and 'T1' to their G-code.
+    islands are the IslandArrays of verts/edges if they are known already (ExportCache), with the island order
+    of settings.tiebreak_xy.
+    island_cache is a dict for incremental exports: it keeps the extrusion G-code of every island under a hash of
+    its content, islands whose hash is in there from the last export are not formatted again. Afterwards it holds
+    the islands of this export. The output is the same as without.
+    Returns the number of extrusion segments written.
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    if islands is None:
+        islands = IslandArrays(verts, edges, settings.tiebreak_xy)
+    area_extrude = settings.area_extrude
+    z_height_extrude = settings.z_height_extrude
+    extrusion_speed = settings.extrusion_speed
+    idx, counts = islands.idx, islands.counts
+    first, middle = islands.first, islands.middle
+
+    if area_extrude is True or z_height_extrude is True:
+        first_layer_offset = (verts[first[0]]+verts[middle[0]])/2 if len(first) else np.zeros(3)
+        offset = np.array([settings.build_volume_x/2, settings.build_volume_y/2, first_layer_offset[2]])
+    else:
+        offset = np.array([settings.build_volume_x/2, settings.build_volume_y/2, 0])
+
+    P1, P2, P3, P4 = (verts[idx[:, col]]+offset for col in (0, 1, 2, 3))
+    P_start = (P1+P4)/2
+    P_end = (P2+P3)/2
+
+    width = settings.nozzle_diameter*1.5
+    multiplier = remap(np.asarray(extrusion_weights, dtype=np.float64)[idx[:, FLOW]], settings.min_flow, settings.max_flow)
+    E = extrusion_amounts(P1, P2, P3, P4, width, multiplier, area_extrude, z_height_extrude)
+
+    speed_weight = remap(np.asarray(speed_weights, dtype=np.float64)[idx[:, SPEED]], settings.min_speed, settings.max_speed)
+    F = extrusion_speed*speed_weight
+
+    #tool of a segment is the color at its flow vert, textblock is appended when it changes
+    tools = np.asarray(tool_colors, dtype=np.float64)[idx[:, FLOW]]
+    tool_changed = tool_changes(tools)
+
+    #travel only from island to island, from the end of the last extruded segment (model origin before the first)
+    if area_extrude is True or z_height_extrude is True:
+        path_start, path_end = P_start, P_end
+    else:
+        path_start, path_end = P4, P3
+    if area_extrude is True or z_height_extrude is True:
+        P_new = (verts[first]+verts[middle])/2+offset
+    else:
+        P_new = verts[middle]+offset
+    ends = np.cumsum(counts)
+    begins = ends-counts
+    last = begins-1
+    travel_start = np.where((last >= 0)[:, None], path_end[np.maximum(last, 0)] if len(path_end) else 0.0, 0.0)
+    retract = (travel_distances(P_new, travel_start) > 1).tolist() #only retract when travel is longer than...
+    ends, begins = ends.tolist(), begins.tolist()
+
+    #extrusion G-code of the islands that are not in island_cache yet, formatted block by block
+    if island_cache is not None:
+        keys = island_keys(path_start, path_end, E, F, tools, tool_changed, begins, ends, textblocks)
+        texts = {}
+        dirty = np.array([k for k, key in enumerate(keys) if key not in island_cache], dtype=np.int64)
+        for d0, d1 in island_blocks(counts[dirty]):
+            block = dirty[d0:d1]
+            n = counts[block]
+            sel = np.arange(int(n.sum()))-np.repeat(np.cumsum(n)-n, n)+np.repeat(np.asarray(begins)[block], n)
+            lines = format_extrusions(path_start[sel], path_end[sel], E[sel], F[sel], tools[sel], tool_changed[sel], textblocks)
+            pos = 0
+            for k, count in zip(block.tolist(), n.tolist()):
+                texts[keys[k]] = ''.join(lines[pos:pos+count])
+                pos += count
+        texts.update((key, island_cache[key]) for key in keys if key not in texts)
+        island_cache.clear()
+        island_cache.update(texts)
+
+    #text is formatted and written island block by island block, only one block of lines is held in memory
+    prev_F=-1
+    with GcodeWriter(filepath) as gcode_txt:
+        gcode_txt.write(textblocks['Start']+'\n')
+
+        for k0, k1 in island_blocks(counts):
+            lo, hi = begins[k0], ends[k1-1]
+            if island_cache is None:
+                lines = format_extrusions(path_start[lo:hi], path_end[lo:hi], E[lo:hi], F[lo:hi], tools[lo:hi], tool_changed[lo:hi], textblocks, prev_F)
+            travels = travel_lines(travel_start[k0:k1], P_new[k0:k1], settings.travel_speed*60, extrusion_speed*60)
+
+            ##islands of extrusions vert indices
+            for k in range(k0, k1):
+                if retract[k]:
+                    gcode_txt.write('G10 \n')
+
+                gcode_txt.write(travels[k-k0])
+
+                if retract[k]:
+                    gcode_txt.write('G11 \n')
+
+                #extrusion between all points in island
+                if island_cache is None:
+                    gcode_txt.writelines(lines[begins[k]-lo:ends[k]-lo])
+                else:
+                    gcode_txt.write(island_cache[keys[k]])
+
+        gcode_txt.write('\n'+textblocks['End'])
+    return len(idx)
@@ -1,8 +1,6 @@
 import bpy
 import time
 import os
-from mathutils import Vector
-import numpy as np
 
 
 from bpy.props import (StringProperty,
@@ -10,6 +8,7 @@ from bpy.props import (StringProperty,
                        PointerProperty,
                        FloatProperty,
                        IntProperty,
+                       EnumProperty,
                        FloatVectorProperty
                        )
 from bpy.types import (Panel,
@@ -21,8 +20,7 @@ from bpy.types import (Panel,
                        
 from bpy_extras.io_utils import ImportHelper
 
-from .parser import *
-from .utils import *
+#parser, export and numpy are imported by the operators on first use, not on add-on registration
 
 
 
@@ -77,11 +75,153 @@ class gcode_settings(bpy.types.PropertyGroup):
         default = False
         )
 
+    layer_attributes: BoolProperty(
+        name="Layer attributes",
+        description="Store layer, tool and style (0 travel, 1 extrude) of every vertex and face as attributes of the one imported object, layers can be selected by them instead of splitting them into objects",
+        default = False
+        )
+
+    preview: BoolProperty(
+        name="Preview",
+        description="Level of detail import: extrusion paths are simplified to the tolerance, layers can be refined to full resolution later",
+        default = False
+        )
+
+    preview_tolerance: FloatProperty(
+        name = "Tolerance",
+        description = "Max distance in mm of a dropped point from the simplified path",
+        default = 0.05,
+        min = 0,
+        precision = 3
+        )
+
+    refine_first_layer: IntProperty(
+        name = "First",
+        description = "First layer to show at full resolution",
+        default = 0,
+        min = 0
+        )
+
+    refine_last_layer: IntProperty(
+        name = "Last",
+        description = "Last layer to show at full resolution",
+        default = 0,
+        min = 0
+        )
+
+    select_first_layer: IntProperty(
+        name = "First",
+        description = "First layer to select",
+        default = 0,
+        min = 0
+        )
+
+    select_last_layer: IntProperty(
+        name = "Last",
+        description = "Last layer to select",
+        default = 0,
+        min = 0
+        )
+
+    hide_other_layers: BoolProperty(
+        name="Hide others",
+        description="Hide the layers outside of the range (edit mode)",
+        default = False
+        )
+
+    low_memory: BoolProperty(
+        name="Low memory",
+        description="Store parsed coordinates as 32 bit floats, halves memory on huge files (mesh coordinates are 32 bit anyway)",
+        default = False
+        )
+
+    bulk_parse: BoolProperty(
+        name="Fast parse",
+        description="Memory map the file and parse all moves in vectorized blocks, much faster on big files. Comments are not kept",
+        default = False
+        )
+
+    import_range: EnumProperty(
+        name="Import",
+        description="Parse and draw the whole file or only some layers, a first pass over the file finds the layers",
+        items=[('ALL', "All layers", "Import the whole file"),
+               ('LAYERS', "Layer range", "Import the layers from first to last layer"),
+               ('Z', "Z range", "Import the layers that start between min and max Z")],
+        default='ALL'
+        )
+
+    layer_index_file: BoolProperty(
+        name="Keep layer index",
+        description="Save the layer index of a file next to it (.nbindex) when it is imported, later range imports of the unchanged file skip the index pass",
+        default = False
+        )
+
+    range_first_layer: IntProperty(
+        name = "First",
+        description = "First layer to import, layer 0 holds the moves before the first layer change",
+        default = 0,
+        min = 0
+        )
+
+    range_last_layer: IntProperty(
+        name = "Last",
+        description = "Last layer to import, layers past the end of the file are ignored",
+        default = 0,
+        min = 0
+        )
+
+    range_min_z: FloatProperty(
+        name = "Min Z",
+        description = "Lowest layer height to import",
+        default = 0
+        )
+
+    range_max_z: FloatProperty(
+        name = "Max Z",
+        description = "Highest layer height to import",
+        default = 1
+        )
+
+    parse_cache: BoolProperty(
+        name="Cache",
+        description="Keep parsed files on disk, importing the same file with the same settings again skips parsing",
+        default = False
+        )
+
+    parse_cache_dir: StringProperty(
+        name = "",
+        description = "Folder of the parse cache. Empty: nozzleboss_cache in the temporary folder",
+        subtype = 'DIR_PATH',
+        default = ""
+        )
+
+    parse_cache_size: IntProperty(
+        name = "MB",
+        description = "Size of the parse cache, least recently used files are deleted when it grows bigger",
+        default = 1024,
+        min = 1
+        )
+
+    parse_workers: IntProperty(
+        name = "Processes",
+        description = "Scan big files in parallel with this many processes (fast parse only)",
+        default = 1,
+        min = 1,
+        max = 64
+        )
+
+    export_path: StringProperty(
+        name = "",
+        description = "G-code file or folder to export to. Empty: <blend file name>.gcode next to the .blend file",
+        subtype = 'FILE_PATH',
+        default = ""
+        )
+
     max_segment_size: FloatProperty(
         name = "",
-        description = "Only Segments bigger then this value get subdivided, too small values here can cause performance issues",
+        description = "Only Segments bigger then this value get subdivided, small values increase the vertex count of the mesh",
         default = 1,
-        min = 0.1,
+        min = 0.01,
         max = 999.0
         )
 
@@ -164,6 +304,18 @@ class gcode_settings(bpy.types.PropertyGroup):
         description="Extrusion based on segment height (difference in z), toolpath based on centre of height edges, preserves line width after deformation",
         default = False
         )
+
+    tiebreak_xy: BoolProperty(
+        name="Order by XY",
+        description="Islands at the same height are exported in order of X, then Y of their start instead of vertex order, which changes with mesh edits",
+        default = False
+        )
+
+    incremental_export: BoolProperty(
+        name="Incremental export",
+        description="Keep the G-code of every island in memory, a re-export of the same object only formats the islands that changed",
+        default = False
+        )
     
 
     
@@ -203,6 +355,36 @@ class NOZZLEBOSS_PT_Panel(bpy.types.Panel):
         sub = row.row()
         sub.prop(nozzleboss, "max_segment_size")  
         sub.enabled =  nozzleboss.subdivide #sub is not grayed out when 'linesegmentatio/subdivide/ bool is True
+
+        col.prop(nozzleboss, 'low_memory')
+        col.prop(nozzleboss, 'layer_attributes')
+        row = col.row(align=True)
+        row.prop(nozzleboss, 'preview')
+        sub = row.row()
+        sub.prop(nozzleboss, 'preview_tolerance')
+        sub.enabled = nozzleboss.preview
+        row = col.row(align=True)
+        row.prop(nozzleboss, 'bulk_parse')
+        sub = row.row()
+        sub.prop(nozzleboss, 'parse_workers')
+        sub.enabled = nozzleboss.bulk_parse
+
+        row = col.row(align=True)
+        row.prop(nozzleboss, 'parse_cache')
+        sub = row.row(align=True)
+        sub.prop(nozzleboss, 'parse_cache_dir')
+        sub.prop(nozzleboss, 'parse_cache_size')
+        sub.enabled = nozzleboss.parse_cache
+
+        col.prop(nozzleboss, 'import_range', text="")
+        row = col.row(align=True)
+        col.prop(nozzleboss, 'layer_index_file')
+        if nozzleboss.import_range == 'LAYERS':
+            row.prop(nozzleboss, 'range_first_layer')
+            row.prop(nozzleboss, 'range_last_layer')
+        elif nozzleboss.import_range == 'Z':
+            row.prop(nozzleboss, 'range_min_z')
+            row.prop(nozzleboss, 'range_max_z')
          
          
         col2=col.column(align=True) 
@@ -211,12 +393,32 @@ class NOZZLEBOSS_PT_Panel(bpy.types.Panel):
         col2.operator("wm.gcode_import") #call it by id name, since specified, otherwise just takes class name
         col.separator(factor=1)
 
+        if obj and obj.type == 'MESH' and obj.data.attributes.get("layer"):
+            col = layout.box().column(align=True)
+            col.label(text="Layers:")
+            row = col.row(align=True)
+            row.prop(nozzleboss, 'select_first_layer')
+            row.prop(nozzleboss, 'select_last_layer')
+            col.prop(nozzleboss, 'hide_other_layers')
+            col.operator("wm.gcode_select_layers")
+
+        if obj and obj.type == 'MESH' and "nozzleboss_source" in obj:
+            col = layout.box().column(align=True)
+            col.label(text="Preview:")
+            row = col.row(align=True)
+            row.prop(nozzleboss, 'refine_first_layer')
+            row.prop(nozzleboss, 'refine_last_layer')
+            col.operator("wm.gcode_refine_layers")
+
         
         col = layout.box().column(align=True)
         col.label(text="Export settings:")
         col.prop(nozzleboss, "nozzle_diameter", text='Nozzle Size')
         col.prop(nozzleboss, "travel_speed", text='Travel Speed')
         col.prop(nozzleboss, "extrusion_speed", text='Extrusion Speed')
+        col.prop(nozzleboss, "export_path", text='Output')
+        col.prop(nozzleboss, 'incremental_export')
+        col.prop(nozzleboss, 'tiebreak_xy')
 
         col.separator(factor=1.5)
         
@@ -284,53 +486,77 @@ class NOZZLEBOSS_PT_Panel(bpy.types.Panel):
 
         
         
-#unit normal vector of plane defined by points a, b, and c
-def unit_normal(a, b, c):
-    x = np.linalg.det([[1,a[1],a[2]],
-         [1,b[1],b[2]],
-         [1,c[1],c[2]]])
-    y = np.linalg.det([[a[0],1,a[2]],
-         [b[0],1,b[2]],
-         [c[0],1,c[2]]])
-    z = np.linalg.det([[a[0],a[1],1],
-         [b[0],b[1],1],
-         [c[0],c[1],1]])
-    magnitude = (x**2 + y**2 + z**2)**.5
-    return (x/magnitude, y/magnitude, z/magnitude)
-
-#area of polygon poly
-def poly_area(poly):
-    if len(poly) < 3: # not a plane - no area
-        return 0
-    total = [0, 0, 0]
-    N = len(poly)
-    for i in range(N):
-        vi1 = poly[i]
-        vi2 = poly[(i+1) % N]
-        prod = np.cross(vi1, vi2)
-        total[0] += prod[0]
-        total[1] += prod[1]
-        total[2] += prod[2]
-    result = np.dot(total, unit_normal(poly[0], poly[1], poly[2]))
-    return abs(result/2)          
+def load_model(nozzleboss, filepath):
+        #classified GcodeModel of the file with the import settings, None when the layer range is empty
+        import numpy as np
+        from .parser import GcodeParser, ParseCache, import_model
+
+        dtype = np.float32 if nozzleboss.low_memory else np.float64
+        subdivide = nozzleboss.max_segment_size if nozzleboss.subdivide else None
+        cache = None
+        if nozzleboss.parse_cache:
+            directory = bpy.path.abspath(nozzleboss.parse_cache_dir) if nozzleboss.parse_cache_dir else None
+            cache = ParseCache(directory, nozzleboss.parse_cache_size<<20)
+        model = None
+        if nozzleboss.import_range == 'ALL' or subdivide is not None:
+            #subdividing can split layers (vase mode), a subdivided range is cut out of the whole file model
+            #so layers are numbered like in a whole file import
+            model = import_model(filepath, dtype, subdivide, nozzleboss.bulk_parse,
+                                 nozzleboss.parse_workers if nozzleboss.bulk_parse else 1, cache, nozzleboss.layer_index_file)
+            if nozzleboss.import_range == 'ALL':
+                return model
+        elif cache is not None:
+            #a cached file is cut out of the cached model instead of parsing the range
+            model = import_model(filepath, dtype, cache=cache, cached_only=True)
+        if model is not None:
+            layers = range_layers(nozzleboss, len(model.layer_starts), model.layers_in_z)
+            if layers is None:
+                return None
+            return model.slice_layers(*layers)
+
+        parse = GcodeParser(dtype)
+        #only the selected layers are parsed and drawn, the index pass only keeps where layers start
+        index = parse.layer_index(filepath, nozzleboss.layer_index_file)
+        layers = range_layers(nozzleboss, len(index), index.layers_in_z)
+        if layers is None:
+            return None
+        model = parse.parseLayers(filepath, index, layers[0], layers[1], bulk=nozzleboss.bulk_parse)
+        model.classifySegments()
+        return model
+
+
+def range_layers(nozzleboss, n_layers, layers_in_z):
+        #(first, last) layer of the import range, None if it holds no layers
+        if nozzleboss.import_range == 'LAYERS':
+            layers = (nozzleboss.range_first_layer, min(nozzleboss.range_last_layer, n_layers-1))
+        else:
+            layers = layers_in_z(nozzleboss.range_min_z, nozzleboss.range_max_z)
+        if layers is None or layers[0] > layers[1]:
+            print("no layers in the selected range, %d layers in the file" % n_layers)
+            return None
+        return layers
+
 
 def import_gcode(context, filepath):
         scene = context.scene
         nozzleboss = scene.nozzleboss
         
-        import time
         then = time.time()
 
-        parse = GcodeParser()
-        model = parse.parseFile(filepath)
-        
-        if nozzleboss.subdivide:
-            model.subdivide(nozzleboss.max_segment_size)
-        model.classifySegments()
+        model = load_model(nozzleboss, filepath)
+        if model is None:
+            return {'CANCELLED'}
+
         if nozzleboss.split_layers:
             model.draw(split_layers=True)
         else:
-            model.draw(split_layers=False)
+            if nozzleboss.preview:
+                model.simplify(nozzleboss.preview_tolerance)
+            obj = model.draw(split_layers=False, layer_attributes=nozzleboss.layer_attributes)
+            if nozzleboss.preview:
+                #where the preview came from, for refining layers later
+                obj["nozzleboss_source"] = filepath
+                obj["nozzleboss_tolerance"] = nozzleboss.preview_tolerance
             
         
 
@@ -342,252 +568,48 @@ def import_gcode(context, filepath):
     
     
 def export_gcode(context):
+    from .blender import ensure_textblocks, read_verts, read_edges, read_vcol_colors, vcol_weights, read_textblock
+    from .export import write_gcode, export_cache
+    import numpy as np
+    from .utils import DEFAULT_TEXTBLOCKS
   
-      #auto create textblocks to, need if you model from scratch (if you import existing they get created in parser)
-    if not bpy.data.texts.get('T0'):
-        bpy.data.texts.new('T0')
-        bpy.data.texts['T0'].write('T0; switch to extruder T0 (any G-code macro can be passed here)\n')
-    if not bpy.data.texts.get('T1'):
-        bpy.data.texts.new('T1')
-        bpy.data.texts['T1'].write('T1; switch to extruder T1 (any G-code macro can be passed here)\n')
-    if not bpy.data.texts.get('Start'):
-        bpy.data.texts.new('Start')
-        bpy.data.texts['Start'].write(';nozzleboss\n')
-        bpy.data.texts['Start'].write('G28 ;homing\n')
-        bpy.data.texts['Start'].write('M104 S180 ;set hotend temp\n')
-        bpy.data.texts['Start'].write('M190 S50 ;wait for bed temp\n')
-        bpy.data.texts['Start'].write('M109 S200 ;wait for hotendtemp\n')
-        bpy.data.texts['Start'].write('M83; relative extrusion mode (REQUIRED)\n')
-
-    if not bpy.data.texts.get('End'):
-        bpy.data.texts.new('End')
-        bpy.data.texts['End'].write('G10 ;retract\n')
-        bpy.data.texts['End'].write('M104 S0 ;deactivate hotend\n')
-        bpy.data.texts['End'].write('M140 S0 ;deactivate bed\n')
-        bpy.data.texts['End'].write('G28 ;homing\n')
-        bpy.data.texts['End'].write('M84 ;turn off motors\n')
-
+    #auto create textblocks to, need if you model from scratch (if you import existing they get created in parser)
+    ensure_textblocks()
 
     scene = context.scene
     nozzleboss = scene.nozzleboss
     then=time.time()
     filename = bpy.path.basename(bpy.data.filepath)
     filename = os.path.splitext(filename)[0] #strip .blend extension
-    gcode_txt = open(bpy.path.abspath("//")+bpy.path.basename(filename)+".gcode","w")
-
-    _txt = []
-    start_code = read_textblock('Start')+'\n'#'G28\nM140 S50\nM109 S190\nM83\nG1 F600\n;RGB,-1,-1,-1\nM163 S0 P0\nM163 S1 P0\nM163 S2 P1\nM163 S3 P1\nM163 S4 P1\nM164 S0\nT0\n'
-    _txt.append(start_code)
-    nozzle_diameter = nozzleboss.nozzle_diameter
-    extrusion_speed = nozzleboss.extrusion_speed
-    travel_speed = nozzleboss.travel_speed
-    build_volume_x = nozzleboss.build_volume_x
-    build_volume_y = nozzleboss.build_volume_y
-    area_extrude = nozzleboss.area_extrude
-    z_height_extrude = nozzleboss.z_height_extrude
+    #output path setting, a folder or nothing: <blend name>.gcode in there or next to the .blend file
+    filepath = bpy.path.abspath(nozzleboss.export_path) if nozzleboss.export_path else bpy.path.abspath("//")
+    if not nozzleboss.export_path or os.path.isdir(filepath) or nozzleboss.export_path.endswith(('/', '\\')):
+        filepath = os.path.join(filepath, bpy.path.basename(filename)+".gcode")
 
     obj = bpy.context.active_object
     verts = read_verts(obj.data)
     edges = read_edges(obj.data)
-    bm = bmesh.new()
-    bm.from_mesh(obj.data)
-    bm.verts.ensure_lookup_table()
     
     #create vertex colors maps, most cases importer could already do that, but in case you have handdrawn/beveled extrusion path
     if not obj.data.vertex_colors.get('Flow'):
         obj.data.vertex_colors.new(name='Flow')
     if not obj.data.vertex_colors.get('Speed'):
         obj.data.vertex_colors.new(name='Speed')
-    if not obj.data.vertex_colors.get('Speed'):
-        obj.data.vertex_colors.new(name='Speed')
     if not obj.data.vertex_colors.get('Tool'):
         obj.data.vertex_colors.new(name='Tool')
         
         
     #Read extrusion and speed multiplier vertex color map
     #gets right loop color for every v_idx
-    extrusion_weights = read_weightmap_from_vcol(obj, 'Flow')
-    speed_weights = read_weightmap_from_vcol(obj, 'Speed')
-    tool_colors = read_weightmap_from_vcol(obj, 'Tool')
-    
-
-    islands = find_islands(edges)
-    sorted_islands = sort_Z(islands, verts)
-    #initial values
-    P_end=(0, 0, 0)
-    P3=(0, 0, 0)
-    prev_F=-1
-    prev_tool_color = -1
-    offset = None        
-
-    ##islands of extrusions vert indices
-    for island in sorted_islands:
-
-        if area_extrude is True or z_height_extrude is True:
-            if offset is None:
-                first_layer_offset = (verts[island[0]]+verts[island[int(len(island)/2)]])/2
-                offset = np.array([build_volume_x/2, build_volume_y/2, first_layer_offset[2]])
-
-            P_new=(verts[island[0]]+verts[island[int(len(island)/2)]])/2+offset
-
-            travel_dist = (Vector(P_new)-Vector(P_end)).length #only retract when travel is longer than...
-            if travel_dist > 1:
-                _txt.append('G10 \n')
-            
-            #travel only from island to island    
-            _txt.append(travel(P_end, P_new, travel_speed*60, extrusion_speed*60)) #verts[island[0]]=next coords
-        else:
-            if offset is None:
-                offset = np.array([build_volume_x/2, build_volume_y/2, 0])
-            #travel_dist = (Vector(verts[island[0]]+offset)-Vector(P2)).length #only retract when travel is longer than...
-            if area_extrude is True or z_height_extrude is True:
-                travel_dist = (Vector((verts[island[0]]+verts[island[int(len(island)/2)]])/2+offset)-Vector(P3)).length #only retract when travel is longer than...
-            else:
-                travel_dist = (Vector((verts[island[int(len(island)/2)]])+offset)-Vector(P3)).length #only retract when travel is longer than...
-
-            
-            if travel_dist > 1:
-                _txt.append('G10 \n')
-            
-            #travel only from island to island    
-            #_txt.append(travel(P2,verts[island[0]]+offset, travel_speed*60, extrusion_speed*60)) #verts[island[0]]=next coords
-            if area_extrude is True or z_height_extrude is True:
-                _txt.append(travel(P3,(verts[island[0]]+verts[island[int(len(island)/2)]])/2+offset, travel_speed*60, extrusion_speed*60)) #verts[island[0]]=next coords
-            else:
-                _txt.append(travel(P3, verts[island[int(len(island)/2)]]+offset, travel_speed*60, extrusion_speed*60)) #verts[island[0]]=next coords
-
-        if travel_dist > 1:
-            _txt.append('G11 \n')   
-            
-            
-        
-        #extrusion and height edges per island, parallel arrays
-        e_edges = island[:int(len(island)/2)] #first half extrusion v_idx, real nozzle path
-        h_edges = island[int(len(island)/2):] #second half of island corresponding height v_idx
-        #print(h_edges)
-        
-
-            
-        island_closed = shared_edge_boolean(bm.verts[e_edges[-1]], bm.verts[e_edges[0]])
-        #extrude between all poitns in island
-        for i in range(len(e_edges)): 
-            if i == len(e_edges)-1 and not island_closed: #dont calc last seg on open island
-                break
-        
-            #exception on last segment if segment is closed grab info from first vert of island
-            if i == len(e_edges)-1:
-                P1 = verts[e_edges[i]]+offset
-                P2 = verts[e_edges[0]]+offset
-                P3 = verts[h_edges[0]]+offset
-                P4 = verts[h_edges[i]]+offset
-                P_start = (P1+P4)/2
-                P_end = (P2+P3)/2
-                width=nozzle_diameter*1.5
-                multiplier = extrusion_weights[e_edges[0]]#
-                multiplier = remap(multiplier, nozzleboss.min_flow, nozzleboss.max_flow)
-
-
-
-                if area_extrude is True:
-                    seg_coords1 = [P1, P2, P3, P4]
-                    seg_coords2 = [P2, P3, P4, P1]
-                    seg_coords3 = [P3, P4, P1, P2]
-                    seg_coords4 = [P4, P1, P2, P3]
-                    area = max(poly_area(seg_coords1), poly_area(seg_coords2), poly_area(seg_coords3), poly_area(seg_coords4))
-                    E_volume=area*width*multiplier
-                else:
-                    if z_height_extrude is True:
-                        dist = np.linalg.norm(P_end-P_start)
-                        height=abs(P1[2]+P2[2]-P3[2]-P4[2])
-                    else:
-                        dist = np.linalg.norm(P3-P4)
-                        height=np.linalg.norm(P3-P2)                        
-                    E_volume=dist*height*width*multiplier
-
-                E=E_volume/2.405281875  ##E axis in mm not mm³, 2.405 is 1mm of 1.75mm filament (r*(PI*r), 0.875*PI*0.875
-
-
-                #calcF
-
-                speed_weight =  remap(speed_weights[e_edges[i]], nozzleboss.min_speed, nozzleboss.max_speed)
-                F = extrusion_speed*speed_weight 
-
-                #check if tool color changed and append corresponding textblock
-                if tool_colors[e_edges[0]]!=prev_tool_color:
-
-                    if tool_colors[e_edges[0]]<0.5:
-                        _txt.append(read_textblock('T1'))
-                    else:
-                        _txt.append(read_textblock('T0'))  
-
-                    prev_tool_color=tool_colors[e_edges[0]]  
-
-
-            else: #usual case
-                #coord for seg length and height
-                P1 = verts[e_edges[i]]+offset
-                P2 = verts[e_edges[i+1]]+offset
-                P3 = verts[h_edges[i+1]]+offset
-                P4 = verts[h_edges[i]]+offset
-                P_start = (P1+P4)/2
-                P_end = (P2+P3)/2
-
-
-                #calcE
-                
-
-                width=nozzle_diameter*1.5
-                multiplier = extrusion_weights[e_edges[i+1]]#
-                multiplier = remap(multiplier, nozzleboss.min_flow, nozzleboss.max_flow)
-                if area_extrude is True:
-                    seg_coords1 = [P1, P2, P3, P4]
-                    seg_coords2 = [P2, P3, P4, P1]
-                    seg_coords3 = [P3, P4, P1, P2]
-                    seg_coords4 = [P4, P1, P2, P3]
-                    area = max(poly_area(seg_coords1), poly_area(seg_coords2) ,poly_area(seg_coords3) ,poly_area(seg_coords4))
-                
-                    E_volume=area*width*multiplier
-                else:
-                    if z_height_extrude is True:
-                        dist = np.linalg.norm(P_end-P_start)
-                        height=abs(P1[2]+P2[2]-P3[2]-P4[2])
-                    else:
-                        dist = np.linalg.norm(P3-P4)
-                        height=np.linalg.norm(P3-P2)                        
-                    E_volume=dist*height*width*multiplier
-
-                E=E_volume/2.405281875  ##E axis in mm not mm³, 2.405 is 1mm of 1.75mm filament (r*(PI*r), 0.875*PI*0.875
-
-
-                #calcF
-
-                speed_weight =  remap(speed_weights[e_edges[i]], nozzleboss.min_speed, nozzleboss.max_speed)
-                F = extrusion_speed*speed_weight 
-
-                #check if tool color changed and append corresponding textblock
-                if tool_colors[e_edges[i+1]]!=prev_tool_color:
-
-                    if tool_colors[e_edges[i+1]]<0.5:
-                        _txt.append(read_textblock('T1'))
-                    else:
-                        _txt.append(read_textblock('T0'))  
-
-                    prev_tool_color=tool_colors[e_edges[i+1]]   
-
-            if area_extrude is True or z_height_extrude is True:
-                _txt.append(extrude(P_start, P_end, E, F, prev_F)) 
-            else:
-                _txt.append(extrude(P4, P3, E, F, prev_F)) 
-
-
-    #print(_txt)
-    end_code = '\n'+read_textblock('End')
-    
-    
-    _txt.append(end_code)
-    gcode_txt.write(''.join(_txt))
-    gcode_txt.close()
-
+    #islands and weightmaps only get recomputed when mesh or colors changed since the last export of the object
+    loop_verts, colors = read_vcol_colors(obj, ('Flow', 'Speed', 'Tool'))
+    extrusion_weights, speed_weights, tool_colors = export_cache.get(obj.name_full, "weights", [np.array(len(verts)), loop_verts]+colors,
+                                                                     lambda: vcol_weights(len(verts), loop_verts, colors))
+    islands = export_cache.islands(obj.name_full, verts, edges, nozzleboss.tiebreak_xy)
+    island_cache = export_cache.island_gcode(obj.name_full) if nozzleboss.incremental_export else None
+
+    textblocks = {name: read_textblock(name) for name in DEFAULT_TEXTBLOCKS}
+    write_gcode(filepath, verts, edges, extrusion_weights, speed_weights, tool_colors, nozzleboss, textblocks, islands, island_cache)
     
     print("took in seconds: ",time.time()-then)
     return {'FINISHED'}     
@@ -614,10 +636,78 @@ class WM_OT_gcode_import(Operator, ImportHelper):
     
     
     
+def select_gcode_layers(context):
+    nozzleboss = context.scene.nozzleboss
+    obj = context.active_object
+    from .blender import select_layers
+
+    #selection and hide flags are mesh data, edit mode keeps its own copy
+    edit_mode = obj.mode == 'EDIT'
+    if edit_mode:
+        bpy.ops.object.mode_set(mode='OBJECT')
+    selected = select_layers(obj, nozzleboss.select_first_layer, nozzleboss.select_last_layer, nozzleboss.hide_other_layers)
+    if edit_mode:
+        bpy.ops.object.mode_set(mode='EDIT')
+    print("selected vertices:", selected)
+    return {'FINISHED'}
+
+
+def refine_gcode_layers(context):
+    nozzleboss = context.scene.nozzleboss
+    obj = context.active_object
+    from .blender import refine_path
+
+    #the file is parsed again with the current import settings (a parse cache makes that cheap), layers in the
+    #range are kept at full resolution and the rest is simplified like the preview
+    then = time.time()
+    model = load_model(nozzleboss, obj["nozzleboss_source"])
+    if model is None:
+        return {'CANCELLED'}
+    model.simplify(obj["nozzleboss_tolerance"], keep_layers=(nozzleboss.refine_first_layer, nozzleboss.refine_last_layer))
+
+    edit_mode = obj.mode == 'EDIT'
+    if edit_mode:
+        bpy.ops.object.mode_set(mode='OBJECT')
+    verts = refine_path(obj, model, obj.data.attributes.get("layer") is not None)
+    if edit_mode:
+        bpy.ops.object.mode_set(mode='EDIT')
+    print("refined preview to", verts, "vertices, took", time.time()-then)
+    return {'FINISHED'}
+
+
+class WM_OT_gcode_refine_layers(Operator):
+    bl_idname = "wm.gcode_refine_layers"
+    bl_label = "Refine Layers"
+    bl_description = "Rebuild a preview import with the layers in the range at full resolution, painted vertex colors are reset"
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH' and "nozzleboss_source" in obj
+
+    def execute(self, context):
+        return refine_gcode_layers(context)
+
+
+class WM_OT_gcode_select_layers(Operator):
+    bl_idname = "wm.gcode_select_layers"
+    bl_label = "Select Layers"
+    bl_description = "Select the layers in the range by the layer attribute of an object imported with layer attributes"
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH' and obj.data.attributes.get("layer") is not None
+
+    def execute(self, context):
+        return select_gcode_layers(context)
+
+
+
 class WM_OT_gcode_export(Operator):
     bl_idname = "wm.gcode_export"  
     bl_label = "Export to G-code"
-    bl_description = "Export active Object to G-code. Result can be found in folder of current .blend file"
+    bl_description = "Export active Object to G-code. Result can be found in folder of current .blend file, or at the output path"
     
     
     @classmethod
@@ -642,6 +732,8 @@ def register():
     bpy.utils.register_class(gcode_settings)
     bpy.utils.register_class(WM_OT_gcode_import)
     bpy.utils.register_class(WM_OT_gcode_export)
+    bpy.utils.register_class(WM_OT_gcode_select_layers)
+    bpy.utils.register_class(WM_OT_gcode_refine_layers)
     bpy.types.Scene.nozzleboss = bpy.props.PointerProperty(type= gcode_settings)
  
 
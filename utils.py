@@ -1,27 +1,24 @@
-import bpy
 import numpy as np
-import bmesh
 
-def read_verts(mesh):
-    mverts_co = np.zeros((len(mesh.vertices) * 3), dtype=float)
-    mesh.vertices.foreach_get("co", mverts_co)
-    return np.reshape(mverts_co, (len(mesh.vertices), 3))
-
-
-def read_edges(mesh): #return np.array
-    fastedges = np.zeros((len(mesh.edges)*2), dtype=int) # [0.0, 0.0] * len(mesh.edges)
-    mesh.edges.foreach_get("vertices", fastedges)
-    return np.reshape(fastedges, (len(mesh.edges), 2))
-
-
-def read_textblock(name):
-    txt = bpy.data.texts[name]
-    textblock=[]
-    for l in txt.lines:
-        textblock.append(l.body+'\n')   
-            
-    textblock="".join(textblock) 
-    return textblock
+#G-code of the textblocks the importer and exporter create when they are missing
+DEFAULT_TEXTBLOCKS = {
+    'T0': 'T0; switch to extruder T0 (any G-code macro can be passed here)\n',
+    'T1': 'T1; switch to extruder T1 (any G-code macro can be passed here)\n',
+    'Start': (';nozzleboss\n'
+              'G28 ;homing\n'
+              'M104 S180 ;set hotend temp\n'
+              'M190 S50 ;wait for bed temp\n'
+              'M109 S200 ;wait for hotendtemp\n'
+              'M83; relative extrusion mode (REQUIRED)\n'),
+    'End': ('G10 ;retract\n'
+            'M104 S0 ;deactivate hotend\n'
+            'M140 S0 ;deactivate bed\n'
+            'G28 ;homing\n'
+            'M84 ;turn off motors\n')}
+
+def textblock_text(text):
+    #what read_textblock() returns for a Blender text with this content, every line gets a '\n'
+    return ''.join(line+'\n' for line in text.split('\n'))
 
 
 def travel(coords, next, travel_speed, extrusion_speed):
@@ -48,10 +45,17 @@ def travel(coords, next, travel_speed, extrusion_speed):
     return gcode_cmd
 
 
-def shared_edge_boolean(v1,v2):
-    for e in v1.link_edges: 
-        if e.other_vert(v1) is v2: 
-            return True  
+def edges_exist(edges, v1, v2):
+    #for arrays of vert index pairs: True where edges has an edge v1-v2, either direction
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    v1 = np.asarray(v1, dtype=np.int64)
+    v2 = np.asarray(v2, dtype=np.int64)
+    size = max(int(edges.max(initial=-1)), int(v1.max(initial=-1)), int(v2.max(initial=-1)))+1
+    keys = np.sort(np.minimum(edges[:, 0], edges[:, 1])*size+np.maximum(edges[:, 0], edges[:, 1]))
+    wanted = np.minimum(v1, v2)*size+np.maximum(v1, v2)
+    if len(keys) == 0:
+        return np.zeros(wanted.shape, dtype=bool)
+    return keys[np.minimum(np.searchsorted(keys, wanted), len(keys)-1)] == wanted
 
 #only print changed axis
 def extrude(coords, next, E, F, prev_F):
@@ -76,217 +80,145 @@ def extrude(coords, next, E, F, prev_F):
     #return string of changed coords
     return gcode_cmd
 
-def bevel_path(obj):#ver_idx wise only extrude, but in respect to layerheight and with vasemode detection
-                    #and clean-up loose verts before extruding
-                    
-    #check if verts are connected, needed for vase mode detection
-    def verts_connected(vidx_start, vidx_end):  
-        depth = vidx_end-vidx_start
-          
-        all_connected=[]
-        for i in range(depth):
-
-            #check for each vert pair
-            P1=bm.verts[i]
-            P2=bm.verts[i+1]
-            
-            #check if vert pair is connected
-            pair_connected=[]
-            for e in P1.link_edges:
-
-                if e in P2.link_edges:#only need to find one True here
-                    pair_connected.append(True)
-
-
-            #if any edge is shared by both verts, the vert pair has a connection
-            if any(pair_connected):
-                all_connected.append(True) 
-                
-            else:
-                all_connected.append(False)
-                
-
-        #if all vert pairs were connected the edge path is continous        
-        if all(all_connected) and len(all_connected)>0:
-            #print('all verts are connected')   
-            return True
-            
-        else:
-            #print('path is broken')
-            return False
-
-
-
-
-    #cleanup, delete loose verts. cause extruding them will cause edge without face loop/without vertex color
-    #own gcode parser seems to add needle vert to 
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.delete_loose(use_edges=False)
-    bpy.ops.object.mode_set(mode='OBJECT')
-
-
-
-    bm = bmesh.new()
-    bm.from_mesh(obj.data)
-
-
-    extruded = bmesh.ops.extrude_edge_only(bm, edges=[e for e in bm.edges]) 
-
-    #return only bmverts from geom
-    translate_verts = [v for v in extruded['geom'] if isinstance(v, bmesh.types.BMVert)]
-
-    #move extruded verts by layer_height
-    #every z change is layer change, can handle variable layer height and vasemode (but not vasemode with variable layer_height)
-    #becomes tricky with vasemode
-    #first layer is non-planar und provides base
-    #only on second layer spiraling starts
-    # -on spiral start very small layerheight/extrusion
-    # -increasing layer height until constant layer_height is reached
-
-    old_Z=0
-
-    normalmode = True
-    start_spiraling = False
-    vasemode=False
-
-    first_layer_height = translate_verts[0].co[2]#first layer as reference for layerheight
-
-
-    bm.verts.ensure_lookup_table()
-    for v in translate_verts:
-
-        cur_Z = round(v.co[2],5)
-      
-        #layer_change or start of spiraling mode  or already ion final vasemopde
-        if old_Z!=cur_Z:
-
-            #3 connected verts with changing Z-heught=spiraling vasemode
-            if not vasemode: #no further spiralstart checks once you entered vase mode      
-                if verts_connected(v.index, v.index+3) and v.co[2]<bm.verts[v.index+3].co[2]:#different Z = start spiral/increment layerheight
-                    start_spiraling=True
-                    normalmode=False
-            
-            
-            if normalmode:
-                layer_height=(cur_Z-old_Z)#+0.3
-                old_Z=cur_Z
-            
-
-                
-            elif start_spiraling:
-                
-                #increment layer height 
-                layer_height = (cur_Z-first_layer_height)#layer_height-(v.co[2]-old_Z) #0.3 - (0.33-0.3)
-
-                
-               # until spirale reaches full layerheight
-                if layer_height>first_layer_height:
-                   # print(' reached vase mndoe')
-                    vasemode=True
-                    start_spiraling=False
-                  
-                    
-                
-            
-            elif vasemode:#layer height stays constant after spiraling in
-                layer_height=first_layer_height
-                
-                 
-        #translate down   
-        v.co[2]-=layer_height
-            
-        
-        
-
-    bm.to_mesh(obj.data)
-    bm.free()
-    obj.data.update()
+def layer_heights(z, connected):
+    #layer height every height vert is moved down by in bevel_path, from the float32 z of the path verts.
+    #a layer change is a change of z rounded to 5 decimals: layer height = z change. at the first layer change
+    #below vert 2 (verts 0-3 connected) spiraling starts: z is compared against the z of the last layer change
+    #before it from then on and the height is z-first layer z, until that exceeds the first layer z (vasemode),
+    #then the height stays the first layer z. verts that are no change keep the height of the vert before
+    z = np.asarray(z, dtype=np.float32).astype(np.float64)
+    n = len(z)
+    heights = np.zeros(n)
+    if n == 0:
+        return heights
+    cur = np.round(z, 5) #x*1e5 is exact for float32 x, so this rounds like round(x, 5)
+    prev = np.empty(n)
+    prev[0] = 0
+    prev[1:] = cur[:-1]
+    change = cur != prev
+    set_at = change.copy()
+    value = cur-prev
+
+    triggers = np.flatnonzero(change & (z < z[2])) if connected and n > 2 else np.empty(0, np.int64)
+    if len(triggers):
+        s = triggers[0]
+        first = z[0]
+        set_at[s:] = cur[s:] != prev[s]
+        spiral = cur[s:]-first
+        vase = np.flatnonzero(set_at[s:] & (spiral > first))
+        value[s:] = spiral
+        if len(vase):
+            value[s+vase[0]+1:] = first
+    #forward fill the last set height, 0 before the first one
+    last = np.where(set_at, np.arange(n), -1)
+    np.maximum.accumulate(last, out=last)
+    heights[last >= 0] = value[last[last >= 0]]
+    return heights
+
+
+def used_verts(n_verts, edges):
+    #mask of the verts that are in an edge, the rest is loose and removed by the bevel
+    used = np.zeros(n_verts, dtype=bool)
+    used[np.asarray(edges, dtype=np.int64).ravel()] = True
+    return used
+
+
+def bevel_arrays(verts, edges):
+    #bevel_path without bpy.ops and bmesh: verts/edges of segments_to_meshdata to the extruded path mesh.
+    #returns float32 verts (path verts, then one height vert per path vert like extrude_edge_only appends them),
+    #edges (path edges, height edges, path vert to height vert) and the quads in between
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+    #cleanup, delete loose verts
+    used = used_verts(len(verts), edges)
+    edges = (np.cumsum(used)-1)[edges]
+    verts = verts[used]
+
+    n = len(verts)
+    k = np.arange(n)
+    all_edges = np.concatenate((edges, edges+n, np.column_stack((k, k+n))))
+    faces = np.column_stack((edges[:, 0], edges[:, 1], edges[:, 1]+n, edges[:, 0]+n))
+
+    #vasemode check of bevel_path: verts_connected() always looks at verts 0-3
+    connected = 2*n > 3 and bool(edges_exist(all_edges, [0, 1, 2], [1, 2, 3]).all())
+
+    #v.co[2] -= layer_height, float32 z minus a double, stored as float32
+    beveled = np.concatenate((verts, verts))
+    beveled[n:, 2] = (verts[:, 2].astype(np.float64)-layer_heights(verts[:, 2], connected)).astype(np.float32)
+    return beveled, all_edges, faces
     
     
     
 #find loose parts/islands in list np.array of edges
 def find_islands(edges):
-    
-    lparts=[]
-    paths={v_idx:set() for v_idx in edges.ravel()} 
-
-    for e in edges:
-        paths[e[0]].add(e[1])
-        paths[e[1]].add(e[0])
-        
+    #connected components of the edge graph with array union-find: hook every root onto the smallest root it
+    #shares an edge with, then pointer jumping, until no edge connects two roots.
+    #returns islands CSR style, vert indices of island k are indices[offsets[k]:offsets[k+1]].
+    #same order as before: islands in order of their first vert in edges.ravel(), verts sorted in an island,
+    #verts without edges are in no island
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if len(edges) == 0:
+        return np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    flat = edges.ravel()
+    parent = np.arange(int(flat.max())+1)
+    v1, v2 = edges[:, 0], edges[:, 1]
     while True:
-        try:
-            i=next(iter(paths.keys()))
-        except StopIteration:
+        p1, p2 = parent[v1], parent[v2]
+        linked = p1 != p2
+        if not linked.any():
             break
-        lpart={i}
-        cur={i}
+        np.minimum.at(parent, np.maximum(p1[linked], p2[linked]), np.minimum(p1[linked], p2[linked]))
         while True:
-            eligible={sc for sc in cur if sc in paths}
-            if not eligible:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
                 break
-            cur={ve for sc in eligible for ve in paths[sc]}
-            lpart.update(cur)
-            for key in eligible: paths.pop(key)
-        lparts.append(sorted(list(lpart))) #make index order of unordered set chronological, works in my case
-    
-    #return np.array(lparts)
-    return np.array(lparts, dtype=object) 
-
-def sort_Z(islands, verts):  #islands = vert_idx,  verts = verts_co
-    sorted_verts=[]
-    for island in islands: #island is list of vert_indices
-        # mean z
-        listz = [verts[v_idx][2] for v_idx in island[:int(len(island)/2)]] #take z coords of first half of islands (where extrusion path lies, other half of beveled path is only for meshing the path und getting height edges)
-        meanz = np.mean(listz)
-        # store island and meanz (and original idx to get sculpt colors of sorted.)
-        sorted_verts.append((island, meanz)) #store vert_indices(island) with Z average
-
-
-    sorted_islands = [data[0] for data in sorted(sorted_verts, key=lambda height: height[1])] #sort islands by Z average
-    
-    return sorted_islands #used z coords of upper half but return islands as whole beveled mesh and slice into extrusion and height edges in 
-    
-    
-    
-##map vertex indices (taken from poly.vertices) to loop_indices
-#so you can access vertex color with vert index instead of loop index
-def read_weightmap_from_vcol(obj, vcol_name):
-    
-    def read_polyverts(obj):#vert indices of polygon
-        polyverts = np.zeros((len(obj.data.polygons) * 4), dtype=int)
-        obj.data.polygons.foreach_get("vertices", polyverts)
-        return polyverts
-        
-    def read_loops(obj): #foreach_get doesn't have a 'loop_indices' attribute
-        loops=[]
-        for p in obj.data.polygons:
-            for li in p.loop_indices:
-                loops.append(li)           
-        return loops
-    
-    #map vert_idx to loop_index, loop index is corresponding to vert_color map entry for that vert_idx
-    vertex_indices = read_polyverts(obj)
-    loop_indices = read_loops(obj)
-    #to get loop index and corresponding vertex color
-    map = {v_idx: l_idx for v_idx, l_idx in zip(vertex_indices, loop_indices)}
-    
-    
-    #order vcol loops by vert idx order
-    vcol=[]
-    for i in range(len(map)):#iter over v_idx in map in ascending order, to get parallel running color array for vert indices
-#    for v_idx in map:
-        loop_idx = map[i]
-        col = obj.data.vertex_colors[vcol_name].data[loop_idx].color[:3]
-        
-        luma = (col[0]*0.299+col[1]*0.587+col[2]*0.114)#/3 already normalized
-        
-        vcol.append(luma)
-    
-    
-    return vcol #return one luma value per vert of weightmap
-
+            parent = jumped
+
+    #island number by first appearance of its root in edges.ravel()
+    roots, first = np.unique(parent[flat], return_index=True)
+    rank = np.empty(len(parent), dtype=np.int64)
+    rank[roots] = np.argsort(np.argsort(first, kind='stable'), kind='stable')
+    used = np.zeros(len(parent), dtype=bool)
+    used[flat] = True
+    verts = np.flatnonzero(used)
+    island = rank[parent[verts]]
+    indices = verts[np.argsort(island, kind='stable')]
+    offsets = np.zeros(len(roots)+1, dtype=np.int64)
+    np.cumsum(np.bincount(island, minlength=len(roots)), out=offsets[1:])
+    return indices, offsets
+
+
+def sort_Z(indices, offsets, verts, tiebreak_xy=False):
+    #order of the CSR islands of find_islands() by the mean Z of their first half (where extrusion path lies, other
+    #half of beveled path is only for meshing the path und getting height edges), as permutation of island numbers.
+    #the means are one add.reduceat over all first halves, same sums as np.mean per island.
+    #equal means keep island order (stable), with tiebreak_xy they are ordered by X then Y of the first island vert
+    #instead, which doesn't depend on vert numbering and stays the same after mesh edits elsewhere
+    verts = np.asarray(verts)
+    counts = np.diff(offsets)
+    half = counts//2
+    #positions of the first half verts in indices
+    starts = np.cumsum(half)-half
+    pos = np.arange(int(half.sum()))-np.repeat(starts, half)+np.repeat(offsets[:-1], half)
+    z = np.asarray(verts[indices[pos], 2], dtype=np.float64)
+    meanz = np.full(len(half), np.nan) #no first half (single vert island), like np.mean([])
+    filled = half > 0
+    if filled.any():
+        meanz[filled] = np.add.reduceat(z, starts[filled])/half[filled]
+    if tiebreak_xy:
+        first = np.asarray(verts[indices[offsets[:-1]]], dtype=np.float64)
+        return np.lexsort((first[:, 1], first[:, 0], meanz))
+    return np.argsort(meanz, kind='stable')
+
+
+def reorder_islands(indices, offsets, order):
+    #CSR islands in the given order (a permutation of island numbers like sort_Z returns)
+    counts = np.diff(offsets)[order]
+    new_offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    pos = np.arange(new_offsets[-1])-np.repeat(new_offsets[:-1], counts)+np.repeat(offsets[:-1][order], counts)
+    return indices[pos], new_offsets
 
 
 def remap(weight, min, max):